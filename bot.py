@@ -3,13 +3,30 @@ import asyncio
 import logging
 import time
 import re
+import html
+import math
+import heapq
+import shutil
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from operator import methodcaller
+from pathlib import Path
 from datetime import datetime, timedelta
+from http.cookiejar import Cookie
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-from telegram.constants import ChatType
+from telegram.ext import AIORateLimiter, Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
+from telegram.constants import ChatType, ParseMode
+from telegram.error import BadRequest
 import yt_dlp
+from yt_dlp.cookies import YoutubeDLCookieJar
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -17,74 +34,220 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Store cookies per user
-user_cookies = {}
+# Store cookies per user (as in-memory yt-dlp cookie jars), least recently used first
+MAX_COOKIE_ENTRIES = int(os.getenv('MAX_COOKIE_ENTRIES', '512'))
+user_cookies = OrderedDict()
 # Store download info for quality selection
 download_queue = {}
-# Pending authorization requests
-pending_auth = {}
+# Pending authorization requests, oldest first; dropped after a day or over the cap
+MAX_PENDING_AUTH = 500
+PENDING_AUTH_TTL = 86400  # seconds
+pending_auth = OrderedDict()
+# Telegram file_id of recent uploads, so repeat requests skip the download
+UPLOAD_CACHE_TTL = int(os.getenv('UPLOAD_CACHE_TTL', '1800'))  # seconds
+upload_cache = {}  # {(url, format_str): {'kind', 'file_id', 'caption', 'filename', 'expiry'}}
 
 # Admin and sudo users with expiry
 ADMIN_ID = int(os.getenv('ADMIN_USER_ID', ''))
 LOG_CHANNEL_ID = os.getenv('LOG_CHANNEL_ID', None)
 sudo_users = {}  # {user_id: expiry_timestamp or None for permanent}
+NOT_SUDO = object()  # sudo_users.get() default, since None means permanent
+sudo_expiry_heap = []  # [(expiry_timestamp, user_id)], may hold stale entries
 authorized_groups = set()
 
+# Changed state is written to disk by a background task
+STATE_FLUSH_INTERVAL = 2  # seconds
+sudo_dirty = False
+groups_dirty = False
+flush_stop = asyncio.Event()  # set on shutdown so the flusher finishes its last write
+
+# Receive updates by webhook when a public host is configured, otherwise long-poll
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', None)
+WEBHOOK_PORT = int(os.getenv('PORT', '8443'))
+
+# Log channel messages are queued and sent in batches by a background task
+LOG_FLUSH_INTERVAL = 3  # seconds
+LOG_BATCH_CHARS = 4096  # Telegram's message length limit
+log_queue = deque(maxlen=1000)  # oldest lines are dropped when full
+
+# Limit how many download+upload jobs run at once
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '4'))
+download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+# yt-dlp is blocking, so it runs in a bounded pool off the event loop.
+# Its ffmpeg merge step is a child process, so merges already run in parallel.
+# Keep workers beyond the download cap free for info extraction.
+YDL_WORKERS = int(os.getenv('YDL_WORKERS', str(MAX_CONCURRENT_DOWNLOADS + 4)))
+ydl_executor = ThreadPoolExecutor(max_workers=YDL_WORKERS, thread_name_prefix='ydl')
+# Working directory for downloads; created once at startup in main()
+DOWNLOADS_DIR = Path('downloads')
+# Optional local Bot API server (e.g. http://localhost:8081), which raises the upload limit
+LOCAL_BOT_API_URL = os.getenv('LOCAL_BOT_API_URL', '').rstrip('/')
+# Reject downloads that would exceed Telegram's upload limit: 50 MB on the public
+# Bot API, 2 GB on a local Bot API server
+MAX_UPLOAD_BYTES = int(os.getenv(
+    'MAX_UPLOAD_BYTES', str(2 * 1024**3 if LOCAL_BOT_API_URL else 50 * 1024**2)
+))
+# One idle info-extraction YoutubeDL per user, reused across /rip calls
+INFO_YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'socket_timeout': 30,
+}
+info_ydl_pool = {}  # {user_id: YoutubeDL}
+
+# Message routing in handle_message
+WATCH_URL_RE = re.compile(r'(?:https?://)?(?:[\w-]+\.)*crunchyroll\.com/(?:[\w-]+/)?watch/\S+')
+JSON_START = frozenset('[{')
+GROUP_CHAT_TYPES = frozenset((ChatType.GROUP, ChatType.SUPERGROUP))
+
+# Command argument parsing
+DURATION_RE = re.compile(r'(\d+)([hdwmy])')
+DURATION_MULTIPLIERS = {
+    'h': 3600,           # hours
+    'd': 86400,          # days
+    'w': 604800,         # weeks
+    'm': 2592000,        # months (30 days)
+    'y': 31536000,       # years (365 days)
+}
+
+# Anything outside letters, digits, space, '-', '_' and '.' is dropped from filenames
+FILENAME_STRIP_RE = re.compile(r'[^\w \-.]')
+
+# JSON helpers: orjson when available, stdlib json otherwise.
+# json_dumps returns newline-terminated UTF-8 bytes, ready to write to a file.
+if orjson:
+    json_loads = orjson.loads
+
+    def json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+else:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return (json.dumps(obj) + '\n').encode()
+
 # Load data from files
 def load_sudo_users():
     global sudo_users
-    if os.path.exists('sudo_users.json'):
-        try:
-            with open('sudo_users.json', 'r') as f:
-                data = json.load(f)
-                sudo_users = {int(k): v for k, v in data.items()}
-                logger.info(f"Loaded {len(sudo_users)} sudo users")
-        except Exception as e:
-            logger.error(f"Error loading sudo users: {e}")
-            sudo_users = {}
+    try:
+        with open('sudo_users.json', 'rb') as f:
+            data = json_loads(f.read())
+            sudo_users = {int(k): v for k, v in data.items()}
+            logger.info(f"Loaded {len(sudo_users)} sudo users")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading sudo users: {e}")
+        sudo_users = {}
     if ADMIN_ID:
         sudo_users[ADMIN_ID] = None  # Admin never expires
+    sudo_expiry_heap[:] = [(expiry, uid) for uid, expiry in sudo_users.items() if expiry is not None]
+    heapq.heapify(sudo_expiry_heap)
+
+def write_json_file(path, payload):
+    """Write a temp file and swap it in so a crash never leaves a torn file (blocking)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
 
-def save_sudo_users():
+async def save_sudo_users():
+    """Write sudo users to disk, returning whether it succeeded"""
     try:
-        with open('sudo_users.json', 'w') as f:
-            json.dump(sudo_users, f)
+        # Serialize on the loop so the dict can't change mid-dump, write in a thread
+        await asyncio.to_thread(write_json_file, 'sudo_users.json', json_dumps(sudo_users))
+        return True
     except Exception as e:
         logger.error(f"Error saving sudo users: {e}")
+        return False
 
 def load_authorized_groups():
     global authorized_groups
-    if os.path.exists('authorized_groups.json'):
-        try:
-            with open('authorized_groups.json', 'r') as f:
-                authorized_groups = set(json.load(f))
-                logger.info(f"Loaded {len(authorized_groups)} authorized groups")
-        except Exception as e:
-            logger.error(f"Error loading groups: {e}")
-            authorized_groups = set()
+    try:
+        with open('authorized_groups.json', 'rb') as f:
+            authorized_groups = set(json_loads(f.read()))
+            logger.info(f"Loaded {len(authorized_groups)} authorized groups")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading groups: {e}")
+        authorized_groups = set()
 
-def save_authorized_groups():
+async def save_authorized_groups():
+    """Write authorized groups to disk, returning whether it succeeded"""
     try:
-        with open('authorized_groups.json', 'w') as f:
-            json.dump(list(authorized_groups), f)
+        await asyncio.to_thread(write_json_file, 'authorized_groups.json', json_dumps(list(authorized_groups)))
+        return True
     except Exception as e:
         logger.error(f"Error saving groups: {e}")
+        return False
+
+def mark_sudo_dirty():
+    """Schedule sudo users to be saved on the next flush"""
+    global sudo_dirty
+    sudo_dirty = True
+
+def mark_groups_dirty():
+    """Schedule authorized groups to be saved on the next flush"""
+    global groups_dirty
+    groups_dirty = True
+
+async def flush_state():
+    """Save any state that changed since the last flush"""
+    global sudo_dirty, groups_dirty
+    # Clear flags before saving so changes made during the write aren't lost,
+    # and set them again on failure so the next flush retries
+    if sudo_dirty:
+        sudo_dirty = False
+        if not await save_sudo_users():
+            sudo_dirty = True
+    if groups_dirty:
+        groups_dirty = False
+        if not await save_authorized_groups():
+            groups_dirty = True
+
+async def flush_state_loop():
+    """Periodically drop expired entries and flush changed state to disk, until flush_stop is set"""
+    while not flush_stop.is_set():
+        try:
+            await asyncio.wait_for(flush_stop.wait(), STATE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        purge_expired_sudo()
+        purge_stale_pending_auth()
+        await flush_state()
+
+def purge_expired_sudo():
+    """Remove sudo users whose access has run out"""
+    now = time.time()
+    while sudo_expiry_heap and sudo_expiry_heap[0][0] <= now:
+        expiry, uid = heapq.heappop(sudo_expiry_heap)
+        # Skip entries left behind by a removal or a newer /addsudo for the same user
+        if sudo_users.get(uid, NOT_SUDO) == expiry:
+            del sudo_users[uid]
+            mark_sudo_dirty()
+
+def purge_stale_pending_auth():
+    """Forget authorization requests the admin never answered"""
+    cutoff = time.time() - PENDING_AUTH_TTL
+    while pending_auth and next(iter(pending_auth.values()))['timestamp'] < cutoff:
+        pending_auth.popitem(last=False)
 
 def is_authorized(user_id: int) -> bool:
     """Check if user is admin or sudo user (and not expired)"""
     if user_id == ADMIN_ID:
         return True
     
-    if user_id not in sudo_users:
+    expiry = sudo_users.get(user_id, NOT_SUDO)
+    if expiry is NOT_SUDO:
         return False
     
-    expiry = sudo_users[user_id]
     if expiry is None:  # Permanent access
         return True
     
     if time.time() > expiry:  # Expired
         del sudo_users[user_id]
-        save_sudo_users()
+        mark_sudo_dirty()
         return False
     
     return True
@@ -94,22 +257,12 @@ def parse_time_duration(duration_str: str) -> int:
     duration_str = duration_str.lower().strip()
     
     # Extract number and unit
-    match = re.match(r'(\d+)([hdwmy])', duration_str)
+    match = DURATION_RE.match(duration_str)
     if not match:
         return None
     
-    amount = int(match.group(1))
-    unit = match.group(2)
-    
-    multipliers = {
-        'h': 3600,           # hours
-        'd': 86400,          # days
-        'w': 604800,         # weeks
-        'm': 2592000,        # months (30 days)
-        'y': 31536000,       # years (365 days)
-    }
-    
-    return amount * multipliers.get(unit, 0)
+    amount, unit = match.groups()
+    return int(amount) * DURATION_MULTIPLIERS[unit]
 
 def format_time_remaining(expiry_timestamp):
     """Format remaining time in human readable format"""
@@ -130,78 +283,61 @@ def format_time_remaining(expiry_timestamp):
     else:
         return f"{int(remaining // 60)}m"
 
-async def log_to_channel(context: ContextTypes.DEFAULT_TYPE, message: str):
-    """Log message to log channel"""
+def log_to_channel(message: str):
+    """Queue a message for the log channel"""
     if LOG_CHANNEL_ID:
+        log_queue.append(message[:LOG_BATCH_CHARS // 2])
+
+def telegram_len(text):
+    """Length as Telegram counts it (UTF-16 code units, so most emoji count twice)"""
+    return len(text.encode('utf-16-le')) // 2
+
+async def flush_log_queue(bot):
+    """Send queued log messages, packing as many as fit into each message"""
+    while log_queue:
+        batch = [log_queue.popleft()]
+        size = telegram_len(batch[0])
+        while log_queue and size + 2 + telegram_len(log_queue[0]) <= LOG_BATCH_CHARS:
+            message = log_queue.popleft()
+            batch.append(message)
+            size += 2 + telegram_len(message)
+        text = "\n\n".join(batch)
         try:
-            await context.bot.send_message(chat_id=LOG_CHANNEL_ID, text=message, parse_mode='Markdown')
+            try:
+                await bot.send_message(chat_id=LOG_CHANNEL_ID, text=text, parse_mode=ParseMode.MARKDOWN)
+            except BadRequest:
+                # One line with stray Markdown (e.g. '_' in a filename) shouldn't lose the whole batch
+                await bot.send_message(chat_id=LOG_CHANNEL_ID, text=text)
         except Exception as e:
             logger.error(f"Error logging to channel: {e}")
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send a message when the command /start is issued."""
-    user_id = update.effective_user.id
-    chat_type = update.effective_chat.type
-    
-    # In groups, only admin can start
-    if chat_type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-        if user_id != ADMIN_ID:
-            return
-        
-        group_id = update.effective_chat.id
-        if group_id not in authorized_groups:
-            authorized_groups.add(group_id)
-            save_authorized_groups()
-            await update.message.reply_text(
-                f"✅ Bot activated in this group!\n"
-                f"Group ID: `{group_id}`\n"
-                f"Authorized users can now use the bot here.",
-                parse_mode='Markdown'
-            )
-            await log_to_channel(context, f"🔓 Bot activated in group: {update.effective_chat.title} ({group_id})")
-        else:
-            await update.message.reply_text("✅ Bot already active in this group!")
-        return
-    
-    # In DM
-    if not is_authorized(user_id):
-        # Create authorization request
-        pending_auth[user_id] = {
-            'username': update.effective_user.username or 'No username',
-            'first_name': update.effective_user.first_name,
-            'timestamp': time.time()
-        }
-        
-        # Notify admin
-        if LOG_CHANNEL_ID:
-            keyboard = [[
-                InlineKeyboardButton("✅ Approve", callback_data=f"auth_approve_{user_id}"),
-                InlineKeyboardButton("❌ Deny", callback_data=f"auth_deny_{user_id}")
-            ]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await context.bot.send_message(
-                chat_id=LOG_CHANNEL_ID,
-                text=f"🔔 **New Authorization Request**\n\n"
-                     f"User: {update.effective_user.first_name}\n"
-                     f"Username: @{update.effective_user.username or 'None'}\n"
-                     f"User ID: `{user_id}`\n\n"
-                     f"Approve or deny access?",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        
-        await update.message.reply_text(
-            "⏳ **Authorization Request Sent**\n\n"
-            f"Your User ID: `{user_id}`\n"
-            f"Username: @{update.effective_user.username or 'None'}\n\n"
-            "Please wait for admin approval.\n"
-            "You'll be notified once approved!",
-            parse_mode='Markdown'
-        )
-        return
-    
-    welcome_message = """
+async def log_flush_loop(bot):
+    """Periodically send queued log messages"""
+    while True:
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        await flush_log_queue(bot)
+
+async def edit_status(status_msg, text):
+    """Edit a status message, ignoring edits that wouldn't change it"""
+    try:
+        await status_msg.edit_text(text)
+    except BadRequest as e:
+        if 'not modified' not in str(e).lower():
+            raise
+
+# Reply texts
+NOT_AUTHORIZED_TEXT = "⚠️ You are not authorized."
+ADMIN_ONLY_TEXT = "⚠️ Admin only."
+NEED_COOKIES_TEXT = "⚠️ Set cookies first: /setcookie"
+# HTML, so the interpolated file name only needs html.escape()
+COOKIES_LOADED_TEXT = (
+    "✅ <b>Cookies loaded successfully!</b>\n\n"
+    "📊 Loaded {count} cookies\n"
+    "📝 File: <code>{file_name}</code>\n\n"
+    "Now you can use: <code>/rip &lt;url&gt;</code>"
+)
+
+WELCOME_TEXT = """
 🎌 **Crunchyroll Downloader Bot**
 
 **Download Commands:**
@@ -230,17 +366,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 Examples: 5h, 3d, 2w, 1m, 1y
 
 Use /help for detailed commands!
-    """
-    await update.message.reply_text(welcome_message, parse_mode='Markdown')
+"""
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send help information."""
-    user_id = update.effective_user.id
-    if not is_authorized(user_id):
-        await update.message.reply_text("⚠️ You are not authorized.")
-        return
-    
-    help_text = """
+HELP_TEXT = """
 **📥 Download Commands:**
 
 **Basic:**
@@ -268,14 +396,93 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 2. Login to crunchyroll.com
 3. Export cookies as JSON
 4. Send to bot with /setcookie
-    """
-    await update.message.reply_text(help_text, parse_mode='Markdown')
+"""
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send a message when the command /start is issued."""
+    user = update.effective_user
+    chat = update.effective_chat
+    user_id = user.id
+    chat_type = chat.type
+    
+    # In groups, only admin can start
+    if chat_type in GROUP_CHAT_TYPES:
+        if user_id != ADMIN_ID:
+            return
+        
+        group_id = chat.id
+        if group_id not in authorized_groups:
+            authorized_groups.add(group_id)
+            mark_groups_dirty()
+            await update.message.reply_text(
+                f"✅ Bot activated in this group!\n"
+                f"Group ID: `{group_id}`\n"
+                f"Authorized users can now use the bot here.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            log_to_channel(f"🔓 Bot activated in group: {chat.title} ({group_id})")
+        else:
+            await update.message.reply_text("✅ Bot already active in this group!")
+        return
+    
+    # In DM
+    if not is_authorized(user_id):
+        # Create authorization request
+        username = user.username
+        pending_auth[user_id] = {
+            'username': username or 'No username',
+            'first_name': user.first_name,
+            'timestamp': time.time()
+        }
+        pending_auth.move_to_end(user_id)
+        while len(pending_auth) > MAX_PENDING_AUTH:
+            pending_auth.popitem(last=False)
+        
+        # Notify admin
+        if LOG_CHANNEL_ID:
+            keyboard = [[
+                InlineKeyboardButton("✅ Approve", callback_data=f"auth_approve_{user_id}"),
+                InlineKeyboardButton("❌ Deny", callback_data=f"auth_deny_{user_id}")
+            ]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await context.bot.send_message(
+                chat_id=LOG_CHANNEL_ID,
+                text=f"🔔 **New Authorization Request**\n\n"
+                     f"User: {user.first_name}\n"
+                     f"Username: @{username or 'None'}\n"
+                     f"User ID: `{user_id}`\n\n"
+                     f"Approve or deny access?",
+                reply_markup=reply_markup,
+                parse_mode=ParseMode.MARKDOWN
+            )
+        
+        await update.message.reply_text(
+            "⏳ **Authorization Request Sent**\n\n"
+            f"Your User ID: `{user_id}`\n"
+            f"Username: @{username or 'None'}\n\n"
+            "Please wait for admin approval.\n"
+            "You'll be notified once approved!",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    await update.message.reply_text(WELCOME_TEXT, parse_mode=ParseMode.MARKDOWN)
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send help information."""
+    user_id = update.effective_user.id
+    if not is_authorized(user_id):
+        await update.message.reply_text(NOT_AUTHORIZED_TEXT)
+        return
+    
+    await update.message.reply_text(HELP_TEXT, parse_mode=ParseMode.MARKDOWN)
 
 async def set_cookie(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Guide user to set cookies."""
     user_id = update.effective_user.id
     if not is_authorized(user_id):
-        await update.message.reply_text("⚠️ You are not authorized.")
+        await update.message.reply_text(NOT_AUTHORIZED_TEXT)
         return
     
     await update.message.reply_text(
@@ -289,7 +496,7 @@ async def set_cookie(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "**Chrome:**\n"
         "Same steps as Firefox!\n\n"
         "⚠️ Make sure you have premium subscription!",
-        parse_mode='Markdown'
+        parse_mode=ParseMode.MARKDOWN
     )
 
 async def add_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -297,7 +504,7 @@ async def add_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     if user_id != ADMIN_ID:
-        await update.message.reply_text("⚠️ Admin only.")
+        await update.message.reply_text(ADMIN_ONLY_TEXT)
         return
     
     if len(context.args) < 2:
@@ -310,13 +517,16 @@ async def add_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "`/addsudo 123456 1m` - 1 month\n"
             "`/addsudo 123456 1y` - 1 year\n"
             "`/addsudo 123456 permanent` - Permanent",
-            parse_mode='Markdown'
+            parse_mode=ParseMode.MARKDOWN
         )
         return
     
     try:
         new_sudo_id = int(context.args[0])
         time_str = context.args[1].lower()
+        if new_sudo_id == ADMIN_ID:
+            await update.message.reply_text("❌ Admin already has permanent access.")
+            return
         
         if time_str == 'permanent':
             expiry = None
@@ -331,7 +541,9 @@ async def add_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             expiry_text = format_time_remaining(expiry)
         
         sudo_users[new_sudo_id] = expiry
-        save_sudo_users()
+        if expiry is not None:
+            heapq.heappush(sudo_expiry_heap, (expiry, new_sudo_id))
+        mark_sudo_dirty()
         
         # Notify the user
         try:
@@ -341,7 +553,7 @@ async def add_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                      f"You now have access to the bot!\n"
                      f"Duration: {expiry_text}\n\n"
                      f"Use /start to begin!",
-                parse_mode='Markdown'
+                parse_mode=ParseMode.MARKDOWN
             )
         except:
             pass
@@ -349,10 +561,10 @@ async def add_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             f"✅ User `{new_sudo_id}` added!\n"
             f"Duration: {expiry_text}",
-            parse_mode='Markdown'
+            parse_mode=ParseMode.MARKDOWN
         )
         
-        await log_to_channel(context, f"➕ Admin added sudo user: {new_sudo_id}\nDuration: {expiry_text}")
+        log_to_channel(f"➕ Admin added sudo user: {new_sudo_id}\nDuration: {expiry_text}")
         
     except ValueError:
         await update.message.reply_text("❌ Invalid user ID.")
@@ -362,11 +574,11 @@ async def remove_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     if user_id != ADMIN_ID:
-        await update.message.reply_text("⚠️ Admin only.")
+        await update.message.reply_text(ADMIN_ONLY_TEXT)
         return
     
     if not context.args:
-        await update.message.reply_text("Usage: `/removesudo <user_id>`", parse_mode='Markdown')
+        await update.message.reply_text("Usage: `/removesudo <user_id>`", parse_mode=ParseMode.MARKDOWN)
         return
     
     try:
@@ -375,9 +587,8 @@ async def remove_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Cannot remove admin.")
             return
         
-        if sudo_id in sudo_users:
-            del sudo_users[sudo_id]
-            save_sudo_users()
+        if sudo_users.pop(sudo_id, NOT_SUDO) is not NOT_SUDO:
+            mark_sudo_dirty()
             
             # Notify user
             try:
@@ -388,8 +599,8 @@ async def remove_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except:
                 pass
             
-            await update.message.reply_text(f"✅ User `{sudo_id}` removed!", parse_mode='Markdown')
-            await log_to_channel(context, f"➖ Admin removed sudo user: {sudo_id}")
+            await update.message.reply_text(f"✅ User `{sudo_id}` removed!", parse_mode=ParseMode.MARKDOWN)
+            log_to_channel(f"➖ Admin removed sudo user: {sudo_id}")
         else:
             await update.message.reply_text("❌ User is not a sudo user.")
     except ValueError:
@@ -400,9 +611,10 @@ async def list_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     if user_id != ADMIN_ID:
-        await update.message.reply_text("⚠️ Admin only.")
+        await update.message.reply_text(ADMIN_ONLY_TEXT)
         return
     
+    purge_expired_sudo()
     if not sudo_users:
         await update.message.reply_text("No sudo users configured.")
         return
@@ -415,13 +627,14 @@ async def list_sudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(
         f"**Sudo Users ({len(sudo_users)}):**\n\n" + "\n".join(sudo_list),
-        parse_mode='Markdown'
+        parse_mode=ParseMode.MARKDOWN
     )
 
 async def my_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check user's status."""
-    user_id = update.effective_user.id
-    username = update.effective_user.username or "No username"
+    user = update.effective_user
+    user_id = user.id
+    username = user.username or "No username"
     
     if user_id == ADMIN_ID:
         role = "👑 Admin"
@@ -441,35 +654,36 @@ async def my_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Username: @{username}\n"
         f"Role: {role}\n"
         f"Status: {status}",
-        parse_mode='Markdown'
+        parse_mode=ParseMode.MARKDOWN
     )
 
 async def auth_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Authorize a group (admin only, must be used in group)."""
     user_id = update.effective_user.id
-    chat_type = update.effective_chat.type
+    chat = update.effective_chat
+    chat_type = chat.type
     
     if user_id != ADMIN_ID:
-        await update.message.reply_text("⚠️ Admin only.")
+        await update.message.reply_text(ADMIN_ONLY_TEXT)
         return
     
-    if chat_type not in [ChatType.GROUP, ChatType.SUPERGROUP]:
+    if chat_type not in GROUP_CHAT_TYPES:
         await update.message.reply_text("❌ This command must be used in a group!")
         return
     
-    group_id = update.effective_chat.id
-    group_name = update.effective_chat.title
+    group_id = chat.id
+    group_name = chat.title
     
     if group_id not in authorized_groups:
         authorized_groups.add(group_id)
-        save_authorized_groups()
+        mark_groups_dirty()
         await update.message.reply_text(
             f"✅ Group authorized!\n"
             f"Group: {group_name}\n"
             f"ID: `{group_id}`",
-            parse_mode='Markdown'
+            parse_mode=ParseMode.MARKDOWN
         )
-        await log_to_channel(context, f"🔓 Group authorized: {group_name} ({group_id})")
+        log_to_channel(f"🔓 Group authorized: {group_name} ({group_id})")
     else:
         await update.message.reply_text("✅ Group already authorized!")
 
@@ -482,14 +696,15 @@ async def auth_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("⚠️ Admin only!", show_alert=True)
         return
     
-    action, user_id = query.data.split('_')[1], int(query.data.split('_')[2])
+    _, action, user_id = query.data.split('_', 2)
+    user_id = int(user_id)
     
-    if user_id not in pending_auth:
+    # Claim the request before any await so a double tap can't process it twice
+    user_info = pending_auth.pop(user_id, None)
+    if user_info is None:
         await query.edit_message_text("❌ Request expired or already processed.")
         return
     
-    user_info = pending_auth[user_id]
-    
     if action == 'approve':
         # Ask admin for duration
         await query.edit_message_text(
@@ -497,9 +712,8 @@ async def auth_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Send duration using:\n"
             f"`/addsudo {user_id} <time>`\n\n"
             f"Example: `/addsudo {user_id} 1m`",
-            parse_mode='Markdown'
+            parse_mode=ParseMode.MARKDOWN
         )
-        del pending_auth[user_id]
     else:
         # Deny
         try:
@@ -511,26 +725,27 @@ async def auth_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
         
         await query.edit_message_text(f"❌ Denied access for user: {user_info['first_name']} ({user_id})")
-        del pending_auth[user_id]
 
 async def rip_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Main download command."""
     user_id = update.effective_user.id
-    chat_type = update.effective_chat.type
+    chat = update.effective_chat
+    chat_type = chat.type
     
     # Check authorization
-    if chat_type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-        group_id = update.effective_chat.id
+    if chat_type in GROUP_CHAT_TYPES:
+        group_id = chat.id
         if group_id not in authorized_groups:
             return
     
     if not is_authorized(user_id):
-        await update.message.reply_text(f"⚠️ Not authorized.\nYour ID: `{user_id}`\nUse /start to request access.", parse_mode='Markdown')
+        await update.message.reply_text(f"⚠️ Not authorized.\nYour ID: `{user_id}`\nUse /start to request access.", parse_mode=ParseMode.MARKDOWN)
         return
     
     if user_id not in user_cookies:
-        await update.message.reply_text("⚠️ Set cookies first: /setcookie")
+        await update.message.reply_text(NEED_COOKIES_TEXT)
         return
+    user_cookies.move_to_end(user_id)
     
     if not context.args:
         await update.message.reply_text(
@@ -538,22 +753,25 @@ async def rip_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "`/rip <url>` - Interactive\n"
             "`/rip <url> -q 1080` - Direct\n\n"
             "Use /help for all options",
-            parse_mode='Markdown'
+            parse_mode=ParseMode.MARKDOWN
         )
         return
     
     url = context.args[0]
-    args_str = ' '.join(context.args[1:])
     
     # Parse flags
     quality = None
-    audio_only = '--audio' in args_str
-    
-    quality_match = re.search(r'-q\s+(\d+)|--quality\s+(\d+)', args_str)
-    if quality_match:
-        quality = quality_match.group(1) or quality_match.group(2)
-    
-    if not re.search(r'crunchyroll\.com', url):
+    audio_only = False
+    args = iter(context.args[1:])
+    for arg in args:
+        if arg == '--audio':
+            audio_only = True
+        elif arg in ('-q', '--quality'):
+            value = next(args, '')
+            if value.isdecimal():  # goes into the format string
+                quality = value
+    
+    if 'crunchyroll.com' not in url:
         await update.message.reply_text("❌ Invalid Crunchyroll URL")
         return
     
@@ -567,25 +785,29 @@ async def direct_download(update, context, url, user_id, quality, audio_only):
     status_msg = await update.message.reply_text("⏳ Starting download...")
     
     try:
-        cookie_file = f"cookies_{user_id}.txt"
-        await create_cookie_file(user_id, cookie_file)
-        
-        info = await fetch_video_info(url, cookie_file, status_msg)
-        if not info:
-            return
-        
-        filename = generate_filename(info)
-        
         if audio_only:
             format_str = 'bestaudio/best'
             ext = 'mp3'
             quality_text = "Audio"
         else:
             format_str = f'bestvideo[height<={quality}]+bestaudio/best[height<={quality}]'
-            ext = 'mkv'
+            ext = 'mp4'
             quality_text = f"{quality}p"
         
-        await download_and_upload(update, context, status_msg, url, cookie_file, format_str, ext, filename, quality_text, user_id)
+        cached = get_cached_upload(url, format_str)
+        if cached:
+            await send_cached_upload(context, status_msg, cached, quality_text, user_id)
+            return
+        
+        cookie_jar = user_cookies[user_id]
+        
+        info = await fetch_video_info(url, user_id, cookie_jar, status_msg)
+        if not info:
+            return
+        
+        filename = generate_filename(info)
+        
+        await download_and_upload(update, context, status_msg, url, info, cookie_jar, format_str, ext, filename, quality_text, user_id)
         
     except Exception as e:
         logger.error(f"Download error: {e}")
@@ -596,10 +818,9 @@ async def show_quality_options(update, context, url, user_id):
     status_msg = await update.message.reply_text("⏳ Fetching qualities...")
     
     try:
-        cookie_file = f"cookies_{user_id}.txt"
-        await create_cookie_file(user_id, cookie_file)
+        cookie_jar = user_cookies[user_id]
         
-        info = await fetch_video_info(url, cookie_file, status_msg)
+        info = await fetch_video_info(url, user_id, cookie_jar, status_msg)
         if not info:
             return
         
@@ -615,7 +836,7 @@ async def show_quality_options(update, context, url, user_id):
             'url': url,
             'info': info,
             'formats': video_formats,
-            'cookie_file': cookie_file
+            'cookie_jar': cookie_jar
         }
         
         keyboard = []
@@ -634,7 +855,7 @@ async def show_quality_options(update, context, url, user_id):
         await status_msg.edit_text(
             f"**{series}**\n{title}\n\n📋 Select quality:",
             reply_markup=reply_markup,
-            parse_mode='Markdown'
+            parse_mode=ParseMode.MARKDOWN
         )
         
     except Exception as e:
@@ -648,19 +869,20 @@ async def quality_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = query.from_user.id
     
-    if user_id not in download_queue:
+    # Claim the session up front so repeated clicks don't start parallel downloads
+    queue_data = download_queue.pop(user_id, None)
+    if queue_data is None:
         await query.edit_message_text("❌ Session expired. Send /rip again.")
         return
     
-    quality = query.data.replace("q_", "")
-    queue_data = download_queue[user_id]
+    quality = query.data[2:]  # strip the "q_" prefix
     
     await query.edit_message_text("⏳ Starting download...")
     
     try:
         url = queue_data['url']
         info = queue_data['info']
-        cookie_file = queue_data['cookie_file']
+        cookie_jar = queue_data['cookie_jar']
         
         filename = generate_filename(info)
         
@@ -670,53 +892,128 @@ async def quality_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             quality_text = "Audio"
         else:
             format_str = f'bestvideo[height<={quality}]+bestaudio/best[height<={quality}]'
-            ext = 'mkv'
+            ext = 'mp4'
             quality_text = f"{quality}p"
         
-        await download_and_upload(query, context, query.message, url, cookie_file, format_str, ext, filename, quality_text, user_id)
-        
-        del download_queue[user_id]
+        await download_and_upload(query, context, query.message, url, info, cookie_jar, format_str, ext, filename, quality_text, user_id)
         
     except Exception as e:
         logger.error(f"Download error: {e}")
         await query.edit_message_text(f"❌ Error: {str(e)}")
 
-async def create_cookie_file(user_id, cookie_file):
-    """Create cookie file from stored cookies."""
-    cookies = user_cookies[user_id]
-    with open(cookie_file, 'w') as f:
-        f.write("# Netscape HTTP Cookie File\n")
-        if isinstance(cookies, list):
-            for cookie in cookies:
-                if isinstance(cookie, dict):
-                    domain = cookie.get('domain', '.crunchyroll.com')
-                    flag = 'TRUE' if domain.startswith('.') else 'FALSE'
-                    path = cookie.get('path', '/')
-                    secure = 'TRUE' if cookie.get('secure', False) else 'FALSE'
-                    expiration = str(int(cookie.get('expirationDate', 0)))
-                    name = cookie.get('name', '')
-                    value = cookie.get('value', '')
-                    f.write(f"{domain}\t{flag}\t{path}\t{secure}\t{expiration}\t{name}\t{value}\n")
-
-async def fetch_video_info(url, cookie_file, status_msg):
+def set_user_cookies(user_id, cookie_jar):
+    """Store a user's cookie jar, evicting the least recently used users over the cap."""
+    user_cookies[user_id] = cookie_jar
+    user_cookies.move_to_end(user_id)
+    drop_info_ydl(user_id)
+    while len(user_cookies) > MAX_COOKIE_ENTRIES:
+        evicted_id, _ = user_cookies.popitem(last=False)
+        drop_info_ydl(evicted_id)
+
+def build_cookie_jar(cookies):
+    """Build an in-memory cookie jar from Cookie-Editor JSON, raising ValueError on bad input."""
+    if not isinstance(cookies, list):
+        raise ValueError("expected a JSON array of cookies")
+    
+    jar = YoutubeDLCookieJar()
+    for number, cookie in enumerate(cookies, 1):
+        if not isinstance(cookie, dict):
+            raise ValueError(f"cookie #{number} is not an object")
+        get = cookie.get
+        name = get('name')
+        value = get('value')
+        if not isinstance(name, str) or not name or not isinstance(value, str):
+            raise ValueError(f"cookie #{number} needs string 'name' and 'value' fields")
+        expiration = get('expirationDate', 0)
+        if not isinstance(expiration, (int, float)) or not math.isfinite(expiration):
+            raise ValueError(f"cookie #{number} has an invalid expirationDate")
+        domain = get('domain', '.crunchyroll.com')
+        if not isinstance(domain, str) or not domain:
+            raise ValueError(f"cookie #{number} has an invalid domain")
+        path = get('path', '/')
+        if not isinstance(path, str):
+            raise ValueError(f"cookie #{number} has an invalid path")
+        
+        expires = int(expiration) or None
+        jar.set_cookie(Cookie(
+            version=0,
+            name=name,
+            value=value,
+            port=None,
+            port_specified=False,
+            domain=domain,
+            domain_specified=True,
+            domain_initial_dot=domain.startswith('.'),
+            path=path,
+            path_specified=True,
+            secure=bool(get('secure', False)),
+            expires=expires,
+            discard=expires is None,
+            comment=None,
+            comment_url=None,
+            rest={}
+        ))
+    return jar
+
+async def fetch_video_info(url, user_id, cookie_jar, status_msg):
     """Fetch video info with retry."""
-    ydl_opts = {
-        'cookiefile': cookie_file,
-        'quiet': True,
-        'no_warnings': True,
-        'socket_timeout': 30,
-    }
-    
+    loop = asyncio.get_running_loop()
     for attempt in range(3):
+        ydl = checkout_info_ydl(user_id, cookie_jar)
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                return ydl.extract_info(url, download=False)
+            return await loop.run_in_executor(ydl_executor, ydl.extract_info, url, False)
         except Exception as e:
             if '429' in str(e) and attempt < 2:
-                await status_msg.edit_text(f"⏳ Rate limited, retry {attempt+1}/3...")
-                time.sleep((attempt+1)*5)
+                await edit_status(status_msg, f"⏳ Rate limited, retry {attempt+1}/3...")
+                await asyncio.sleep((attempt+1)*5)
             else:
                 raise
+        finally:
+            checkin_info_ydl(user_id, ydl)
+
+def checkout_info_ydl(user_id, cookie_jar):
+    """Take the user's idle info-extraction YoutubeDL, or build a new one."""
+    ydl = info_ydl_pool.pop(user_id, None)
+    if ydl is None or ydl.cookiejar is not cookie_jar:
+        if ydl is not None:
+            ydl.close()
+        ydl = yt_dlp.YoutubeDL(INFO_YDL_OPTS)
+        ydl.cookiejar = cookie_jar
+    return ydl
+
+def checkin_info_ydl(user_id, ydl):
+    """Return a YoutubeDL to the pool if it still matches the user's cookies."""
+    if user_id not in info_ydl_pool and ydl.cookiejar is user_cookies.get(user_id):
+        info_ydl_pool[user_id] = ydl
+    else:
+        ydl.close()
+
+def drop_info_ydl(user_id):
+    """Close the user's pooled YoutubeDL, e.g. after their cookies change."""
+    ydl = info_ydl_pool.pop(user_id, None)
+    if ydl is not None:
+        ydl.close()
+
+def run_estimate_size(ydl, info):
+    """Estimate the size in bytes of the selected formats (blocking, runs in ydl_executor)."""
+    selected = ydl.process_ie_result(ydl.sanitize_info(info, True), download=False)
+    return selected.get('filesize') or selected.get('filesize_approx') or 0
+
+def is_single_video(info):
+    """Whether info is one video that process_ie_result can download as-is."""
+    # sanitize_info drops 'entries', so playlists/series can't be re-processed from it
+    return info.get('_type', 'video') == 'video'
+
+def run_download(ydl, url, info):
+    """Download an already-extracted video, or the URL itself for playlists (blocking, runs in ydl_executor)."""
+    if not is_single_video(info):
+        ydl.download([url])
+        return
+    try:
+        ydl.process_ie_result(ydl.sanitize_info(info, True), download=True)
+    except yt_dlp.utils.DownloadError:
+        # Stream URLs in the info may have expired, so extract again
+        ydl.download([info['webpage_url']])
 
 def generate_filename(info):
     """Generate proper filename."""
@@ -726,70 +1023,180 @@ def generate_filename(info):
     title = info.get('episode', info.get('title', 'Unknown'))
     
     filename = f"{series} - S{season:02d}E{episode:02d} - {title}"
-    return "".join(c for c in filename if c.isalnum() or c in (' ', '-', '_', '.')).strip()
+    return FILENAME_STRIP_RE.sub('', filename).strip()
+
+def get_cached_upload(url, format_str):
+    """Return the cached upload for this URL and format, if it hasn't expired."""
+    cached = upload_cache.get((url, format_str))
+    if cached and cached['expiry'] > time.time():
+        return cached
+    return None
+
+def cache_upload(url, format_str, message, caption, filename):
+    """Remember the file_id of an uploaded file and drop expired entries."""
+    now = time.time()
+    for key in [k for k, v in upload_cache.items() if v['expiry'] <= now]:
+        del upload_cache[key]
+    
+    if message.audio:
+        kind, file_id = 'audio', message.audio.file_id
+    elif message.video:
+        kind, file_id = 'video', message.video.file_id
+    elif message.document:
+        kind, file_id = 'document', message.document.file_id
+    else:
+        return
+    
+    upload_cache[(url, format_str)] = {
+        'kind': kind,
+        'file_id': file_id,
+        'caption': caption,
+        'filename': filename,
+        'expiry': now + UPLOAD_CACHE_TTL
+    }
+
+async def send_cached_upload(context, status_msg, cached, quality_text, user_id):
+    """Re-send a previously uploaded file by its Telegram file_id."""
+    if cached['kind'] == 'audio':
+        await status_msg.reply_audio(audio=cached['file_id'], caption=cached['caption'])
+    elif cached['kind'] == 'video':
+        await status_msg.reply_video(video=cached['file_id'], caption=cached['caption'], supports_streaming=True)
+    else:
+        await status_msg.reply_document(document=cached['file_id'], caption=cached['caption'])
+    
+    await status_msg.delete()
+    
+    log_to_channel(f"📥 Download (cached): {cached['filename']}\nUser: {user_id}\nQuality: {quality_text}")
+    
+    logger.info(f"User {user_id} downloaded from cache: {cached['filename']} ({quality_text})")
+
+def too_large_text(size):
+    """Reply for a download over MAX_UPLOAD_BYTES."""
+    return f"❌ Too large ({size / 1024**2:.0f} MB > {MAX_UPLOAD_BYTES / 1024**2:.0f} MB upload limit)"
 
-async def download_and_upload(source, context, status_msg, url, cookie_file, format_str, ext, filename, quality_text, user_id):
+async def download_and_upload(source, context, status_msg, url, info, cookie_jar, format_str, ext, filename, quality_text, user_id):
     """Download and upload file."""
+    # Each job gets its own directory: concurrent jobs for the same episode
+    # (other user or quality) would otherwise share, skip and delete one file
+    job_dir = Path(tempfile.mkdtemp(dir=DOWNLOADS_DIR))
     ydl_opts = {
-        'cookiefile': cookie_file,
         'format': format_str,
         'merge_output_format': ext,
-        'outtmpl': f'downloads/{filename}.%(ext)s',
+        'outtmpl': str(job_dir / f'{filename}.%(ext)s'),
         'socket_timeout': 30,
+        # Fetch HLS fragments in parallel and retry flaky ones
+        'concurrent_fragment_downloads': 8,
+        'hls_prefer_native': True,
+        'http_chunk_size': 10 * 1024 * 1024,
+        'retries': 5,
+        'fragment_retries': 5,
+        'extractor_retries': 3,
     }
     
-    for attempt in range(3):
-        try:
-            await status_msg.edit_text(f"📥 Downloading {quality_text}...")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            break
-        except Exception as e:
-            if '429' in str(e) and attempt < 2:
-                time.sleep((attempt+1)*5)
+    loop = asyncio.get_running_loop()
+    ydl = None
+    try:
+        # One YoutubeDL serves both the size estimate and the download
+        ydl = yt_dlp.YoutubeDL(ydl_opts)
+        ydl.cookiejar = cookie_jar
+        
+        # Playlists have no single format to size up front
+        size = 0
+        if is_single_video(info):
+            size = await loop.run_in_executor(ydl_executor, run_estimate_size, ydl, info)
+        if size > MAX_UPLOAD_BYTES:
+            await status_msg.edit_text(too_large_text(size))
+            return
+        
+        if download_semaphore.locked():
+            await edit_status(status_msg, "⏳ Queued, waiting for a free download slot...")
+        
+        async with download_semaphore:
+            # Another job may have uploaded the same file while this one was queued
+            cached = get_cached_upload(url, format_str)
+            if cached:
+                await send_cached_upload(context, status_msg, cached, quality_text, user_id)
+                return
+            
+            for attempt in range(3):
+                try:
+                    await edit_status(status_msg, f"📥 Downloading {quality_text}...")
+                    await loop.run_in_executor(ydl_executor, run_download, ydl, url, info)
+                    break
+                except Exception as e:
+                    if '429' in str(e) and attempt < 2:
+                        await asyncio.sleep((attempt+1)*5)
+                    else:
+                        raise
+            
+            output_file = job_dir / f"{filename}.{ext}"
+            file_stat = await asyncio.to_thread(output_file.stat)
+            file_size_mb = file_stat.st_size / 1024 / 1024
+            
+            # The estimate can be missing (0), so check again before reading it into memory
+            if file_stat.st_size > MAX_UPLOAD_BYTES:
+                await status_msg.edit_text(too_large_text(file_stat.st_size))
+                return
+            
+            await edit_status(status_msg, f"📤 Uploading... ({file_size_mb:.2f} MB)")
+            
+            if LOCAL_BOT_API_URL:
+                # In local mode PTB sends a file:// URI and the Bot API server reads the file itself
+                media = output_file
             else:
-                raise
-    
-    output_file = f"downloads/{filename}.{ext}"
-    file_size_mb = os.path.getsize(output_file) / 1024 / 1024
-    
-    await status_msg.edit_text(f"📤 Uploading... ({file_size_mb:.2f} MB)")
-    
-    with open(output_file, 'rb') as video:
-        if ext == 'mp3':
-            await status_msg.reply_audio(
-                audio=video,
-                caption=f"🎵 {filename}",
-                read_timeout=300,
-                write_timeout=300
-            )
-        else:
-            await status_msg.reply_video(
-                video=video,
-                caption=f"🎌 {filename}\n📺 {quality_text} | 📦 {file_size_mb:.2f} MB",
-                supports_streaming=True,
-                read_timeout=300,
-                write_timeout=300
-            )
+                # The public API needs the bytes (at most MAX_UPLOAD_BYTES). PTB would read
+                # a path synchronously in full, so load it in a thread instead
+                media = await asyncio.to_thread(output_file.read_bytes)
+            if ext == 'mp3':
+                caption = f"🎵 {filename}"
+                message = await status_msg.reply_audio(
+                    audio=media,
+                    filename=f"{filename}.{ext}",
+                    caption=caption,
+                    read_timeout=300,
+                    write_timeout=300
+                )
+            else:
+                caption = f"🎌 {filename}\n📺 {quality_text} | 📦 {file_size_mb:.2f} MB"
+                message = await status_msg.reply_video(
+                    video=media,
+                    filename=f"{filename}.{ext}",
+                    caption=caption,
+                    supports_streaming=True,
+                    read_timeout=300,
+                    write_timeout=300
+                )
+            
+            del media
+            cache_upload(url, format_str, message, caption, filename)
+        
+    finally:
+        if ydl is not None:
+            ydl.close()
+        # Also removes partial downloads after a failure. Deleting multi-GB
+        # files can block on slow filesystems, so do it off the loop
+        await asyncio.to_thread(shutil.rmtree, job_dir, ignore_errors=True)
     
-    os.remove(output_file)
-    os.remove(cookie_file)
-    await status_msg.delete()
+    try:
+        await status_msg.delete()
+    except Exception as e:
+        logger.warning(f"Cleanup error: {e}")
     
     # Log to channel
-    await log_to_channel(context, f"📥 Download: {filename}\nUser: {user_id}\nQuality: {quality_text}\nSize: {file_size_mb:.2f} MB")
+    log_to_channel(f"📥 Download: {filename}\nUser: {user_id}\nQuality: {quality_text}\nSize: {file_size_mb:.2f} MB")
     
     logger.info(f"User {user_id} downloaded: {filename} ({quality_text})")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle text messages (cookies or URLs)."""
     user_id = update.effective_user.id
+    chat = update.effective_chat
     text = update.message.text
-    chat_type = update.effective_chat.type
+    chat_type = chat.type
     
     # In groups, check if authorized
-    if chat_type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-        group_id = update.effective_chat.id
+    if chat_type in GROUP_CHAT_TYPES:
+        group_id = chat.id
         if group_id not in authorized_groups:
             return
     
@@ -797,32 +1204,38 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Cookie data
-    if text.startswith('[') or text.startswith('{'):
+    if text[:1] in JSON_START:
         try:
-            cookies = json.loads(text)
-            user_cookies[user_id] = cookies
-            await update.message.reply_text("✅ Cookies saved!\n\nUse: `/rip <url>`", parse_mode='Markdown')
-        except:
+            cookies = json_loads(text)
+            set_user_cookies(user_id, build_cookie_jar(cookies))
+        except json.JSONDecodeError:
             await update.message.reply_text("❌ Invalid JSON format.")
+            return
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Invalid cookies: {e}")
+            return
+        await update.message.reply_text("✅ Cookies saved!\n\nUse: `/rip <url>`", parse_mode=ParseMode.MARKDOWN)
         return
     
     # URL without /rip command
-    if 'crunchyroll.com/watch' in text:
-        await update.message.reply_text("Use: `/rip " + text + "`", parse_mode='Markdown')
+    match = WATCH_URL_RE.search(text)
+    if match:
+        await update.message.reply_text("Use: `/rip " + match.group(0) + "`", parse_mode=ParseMode.MARKDOWN)
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle document uploads (cookie JSON files)."""
     user_id = update.effective_user.id
-    chat_type = update.effective_chat.type
+    chat = update.effective_chat
+    chat_type = chat.type
     
     # In groups, check if authorized
-    if chat_type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-        group_id = update.effective_chat.id
+    if chat_type in GROUP_CHAT_TYPES:
+        group_id = chat.id
         if group_id not in authorized_groups:
             return
     
     if not is_authorized(user_id):
-        await update.message.reply_text(f"⚠️ Not authorized.\nYour ID: `{user_id}`", parse_mode='Markdown')
+        await update.message.reply_text(f"⚠️ Not authorized.\nYour ID: `{user_id}`", parse_mode=ParseMode.MARKDOWN)
         return
     
     document = update.message.document
@@ -840,57 +1253,80 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     status_msg = await update.message.reply_text("📥 Reading cookie file...")
     
     try:
-        # Download file
+        # Download straight into memory; cookie files are capped at 5MB above
         file = await context.bot.get_file(document.file_id)
-        file_path = f"cookies_upload_{user_id}.json"
-        await file.download_to_drive(file_path)
+        content = await file.download_as_bytearray()
         
-        # Read and parse JSON
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            cookies = json.loads(content)
+        # Parse JSON in a thread (files can be up to 5MB), then drop the raw bytes
+        cookies = await asyncio.to_thread(json_loads, content)
+        del content
         
         # Validate it's a cookie array
         if not isinstance(cookies, list):
             await status_msg.edit_text("❌ Invalid cookie format. Should be an array of cookies.")
-            os.remove(file_path)
             return
         
         # Check if it has cookie-like objects
         if len(cookies) == 0:
             await status_msg.edit_text("❌ Empty cookie file!")
-            os.remove(file_path)
             return
         
-        # Save cookies
-        user_cookies[user_id] = cookies
-        
-        # Cleanup
-        os.remove(file_path)
+        # Save cookies; only the jar is kept
+        cookie_count = len(cookies)
+        set_user_cookies(user_id, build_cookie_jar(cookies))
+        del cookies
         
         await status_msg.edit_text(
-            f"✅ **Cookies loaded successfully!**\n\n"
-            f"📊 Loaded {len(cookies)} cookies\n"
-            f"📝 File: `{document.file_name}`\n\n"
-            f"Now you can use: `/rip <url>`",
-            parse_mode='Markdown'
+            COOKIES_LOADED_TEXT.format(count=cookie_count, file_name=html.escape(document.file_name)),
+            parse_mode=ParseMode.HTML
         )
         
-        await log_to_channel(context, f"🍪 User {user_id} uploaded cookie file: {document.file_name} ({len(cookies)} cookies)")
+        log_to_channel(f"🍪 User {user_id} uploaded cookie file: {document.file_name} ({cookie_count} cookies)")
         
     except json.JSONDecodeError as e:
         await status_msg.edit_text(f"❌ Invalid JSON file. Please check the format.\n\nError: {str(e)}")
-        if os.path.exists(file_path):
-            os.remove(file_path)
     except Exception as e:
         logger.error(f"Error processing cookie file: {e}")
         await status_msg.edit_text(f"❌ Error reading file: {str(e)}")
-        if os.path.exists(file_path):
-            os.remove(file_path)
+
+async def post_init(application: Application):
+    """Start background tasks once the bot is initialized."""
+    application.bot_data['flush_task'] = asyncio.create_task(flush_state_loop())
+    application.bot_data['log_task'] = asyncio.create_task(log_flush_loop(application.bot))
+
+async def post_stop(application: Application):
+    """Send remaining log messages while the bot can still make requests."""
+    application.bot_data['log_task'].cancel()
+    await flush_log_queue(application.bot)
+
+async def post_shutdown(application: Application):
+    """Stop background tasks and write out pending state."""
+    # Let the flusher finish instead of cancelling it: a cancelled to_thread write
+    # keeps running in its thread and could race the final flush on the tmp file
+    flush_stop.set()
+    await asyncio.gather(application.bot_data['flush_task'], return_exceptions=True)
+    await flush_state()
+
+# Command and button handlers registered in main()
+COMMAND_HANDLERS = (
+    ("start", start),
+    ("help", help_command),
+    ("setcookie", set_cookie),
+    ("rip", rip_command),
+    ("addsudo", add_sudo),
+    ("removesudo", remove_sudo),
+    ("listsudo", list_sudo),
+    ("mystatus", my_status),
+    ("authgroup", auth_group),
+)
+CALLBACK_HANDLERS = (  # matched by callback data prefix
+    ("q_", quality_callback),
+    ("auth_", auth_callback),
+)
 
 def main():
     """Start the bot."""
-    os.makedirs('downloads', exist_ok=True)
+    DOWNLOADS_DIR.mkdir(exist_ok=True)
     load_sudo_users()
     load_authorized_groups()
     
@@ -908,26 +1344,60 @@ def main():
     logger.info(f"Authorized groups: {len(authorized_groups)}")
     if LOG_CHANNEL_ID:
         logger.info(f"Log channel: {LOG_CHANNEL_ID}")
+    if LOCAL_BOT_API_URL:
+        logger.info(f"Local Bot API server: {LOCAL_BOT_API_URL}")
+    logger.info(f"Upload limit: {MAX_UPLOAD_BYTES / 1024**2:.0f} MB")
     
-    application = Application.builder().token(token).build()
+    # Use uvloop for the event loop when it is installed
+    try:
+        import uvloop
+        uvloop.install()
+        logger.info("Using uvloop event loop")
+    except ImportError:
+        pass
+    
+    builder = (
+        Application.builder()
+        .token(token)
+        .rate_limiter(AIORateLimiter(max_retries=3))
+        # Handle updates as concurrent tasks so a long /rip doesn't hold up everyone else
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if LOCAL_BOT_API_URL:
+        builder = (
+            builder
+            .base_url(f"{LOCAL_BOT_API_URL}/bot")
+            .base_file_url(f"{LOCAL_BOT_API_URL}/file/bot")
+            .local_mode(True)
+        )
+    application = builder.build()
     
     # Handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("setcookie", set_cookie))
-    application.add_handler(CommandHandler("rip", rip_command))
-    application.add_handler(CommandHandler("addsudo", add_sudo))
-    application.add_handler(CommandHandler("removesudo", remove_sudo))
-    application.add_handler(CommandHandler("listsudo", list_sudo))
-    application.add_handler(CommandHandler("mystatus", my_status))
-    application.add_handler(CommandHandler("authgroup", auth_group))
-    application.add_handler(CallbackQueryHandler(quality_callback, pattern="^q_"))
-    application.add_handler(CallbackQueryHandler(auth_callback, pattern="^auth_"))
+    application.add_handlers([CommandHandler(name, callback) for name, callback in COMMAND_HANDLERS])
+    # A callable pattern gets a plain startswith() instead of a regex match per button press
+    application.add_handlers([
+        CallbackQueryHandler(callback, pattern=methodcaller('startswith', prefix))
+        for prefix, callback in CALLBACK_HANDLERS
+    ])
     application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
     logger.info("Bot started!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_HOST:
+        logger.info(f"Webhook: https://{WEBHOOK_HOST}/<token> (listening on port {WEBHOOK_PORT})")
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=WEBHOOK_PORT,
+            url_path=token,
+            webhook_url=f"https://{WEBHOOK_HOST}/{token}",
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        # Long-poll for as long as the Bot API allows to cut down on getUpdates calls
+        application.run_polling(timeout=50, allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()